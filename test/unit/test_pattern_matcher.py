@@ -66,6 +66,13 @@ class TestPatternMatcher(unittest.TestCase):
     self.assertEqual(matcher.rewrite(c1), c1)
     self.assertEqual(matcher.rewrite(c2), None)
 
+  def test_pdict_by_op(self):
+    matcher = PatternMatcher([(UPat(GroupOp.Binary, name="x"), lambda x: x), (UPat(Ops.CONST, name="x"), lambda x: x)])
+    self.assertEqual(set(matcher.pdict), set(GroupOp.Binary)|{Ops.CONST})
+    c1 = UOp(Ops.CONST, dtypes.float, arg=1.0)
+    self.assertEqual(matcher.rewrite(c1+c1), c1+c1)
+    self.assertIsNone(matcher.rewrite(c1.sqrt()))
+
   def test_uop_set(self):
     matcher = PatternMatcher([(UPat((Ops.CONST, Ops.CAST), name="x"), lambda x: x)])
     c1 = UOp(Ops.CONST, dtypes.bool, arg=False)
@@ -49,5 +49,11 @@ class TestUPatCompile(unittest.TestCase):
     up = UPat(Ops.CAST, dtypes.float, UPat.var("x", dtypes.bfloat16))
     do_compile(up)
 
+  def test_spec_compiles(self):
+    # type_verify runs on every uop, none of the spec patterns should fall back to upat_interpret
+    from tinygrad.spec import spec, tensor_uop_spec, sched_spec, shape_spec
+    for pm in [spec, tensor_uop_spec, sched_spec, shape_spec]:
+      for p,fxn in pm.patterns: self.assertIsNotNone(upat_compile(p, fxn), f"failed to compile {p.printable()}")
+
 if __name__ == "__main__":
   unittest.main()
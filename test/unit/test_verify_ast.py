@@ -5,7 +5,7 @@ from tinygrad import Tensor
 from tinygrad.codegen.kernel import Kernel
 from tinygrad.helpers import DEBUG
 from tinygrad.ops import UOp, Ops, print_uops
-from tinygrad.spec import type_verify, shape_spec
+from tinygrad.spec import type_verify, shape_spec, verify_sink_dims
 from tinygrad.shape.shapetracker import ShapeTracker
 from tinygrad import dtypes
 from tinygrad.shape.view import View
@@ -95,5 +95,34 @@ class TestVerifyAST(unittest.TestCase):
     st = UOp.store(buf, ShapeTracker.from_shape(()).to_uop(), a.cast(dtypes.float))
     helper_test_verify_ast(st)
 
+  def test_verify_cached_per_spec(self):
+    bufs = [UOp(Ops.DEFINE_GLOBAL, dtypes.float.ptr(), (), i) for i in range(2)]
+    a = UOp(Ops.LOAD, dtypes.float, (bufs[1], ShapeTracker.from_shape((4, 32)).to_uop()))
+    b = a + UOp(Ops.REDUCE_AXIS, dtypes.float, (a,), (Ops.MAX, (1,)))
+    sink = UOp(Ops.SINK, dtypes.void, (UOp(Ops.STORE, dtypes.void, (bufs[0], ShapeTracker.from_shape((4, 32)).to_uop(), b)),))
+    # passing the base spec must not let the same uops skip the shape spec
+    type_verify(list(sink.toposort))
+    type_verify(list(sink.toposort))
+    with self.assertRaises(RuntimeError): type_verify(list(sink.toposort), shape_spec)
+
+  def test_sink_dims_mixed_rank(self):
+    bufs = [UOp(Ops.DEFINE_GLOBAL, dtypes.float.ptr(), (), i) for i in range(4)]
+    b = UOp(Ops.LOAD, dtypes.float, (bufs[1], ShapeTracker.from_shape((4, 3, 2)).to_uop()))
+    st0 = UOp.store(bufs[0], ShapeTracker.from_shape((4, 3, 2)).to_uop(), b)
+    a = UOp(Ops.LOAD, dtypes.float, (bufs[3], ShapeTracker.from_shape((4,)).to_uop()))
+    st1 = UOp.store(bufs[2], ShapeTracker.from_shape((4, 2, 3)).to_uop(), a)
+    # like zip, only the dims shared by every shape are checked, even if the extra dims are seen first
+    self.assertTrue(verify_sink_dims(UOp(Ops.SINK, dtypes.void, (st0, st1))))
+    c = UOp(Ops.LOAD, dtypes.float, (bufs[3], ShapeTracker.from_shape((4, 1)).to_uop()))
+    st2 = UOp.store(bufs[2], ShapeTracker.from_shape((4, 2, 3)).to_uop(), c)
+    self.assertFalse(verify_sink_dims(UOp(Ops.SINK, dtypes.void, (st0, st2))))
+
+  def test_sink_dims_symbolic(self):
+    bufs = [UOp(Ops.DEFINE_GLOBAL, dtypes.float.ptr(), (), i) for i in range(2)]
+    a = UOp(Ops.LOAD, dtypes.float, (bufs[1], ShapeTracker.from_shape((3, 4)).to_uop()))
+    st = UOp.store(bufs[0], ShapeTracker.from_shape((UOp.variable("a", 0, 2), 4)).to_uop(), a)
+    # a Variable next to a mismatched int dim is rejected, not compared symbolically
+    self.assertFalse(verify_sink_dims(UOp(Ops.SINK, dtypes.void, (st,))))
+
 if __name__ == '__main__':
   unittest.main()
@@ -709,11 +709,11 @@ def lines(fn) -> list[str]:
 
 class UPat(MathTrait):
   __slots__ = ("op", "dtype", "arg", "name", "src")
-  def __init__(self, op:Optional[Union[Ops, tuple[Ops, ...], set[Ops]]]=None, dtype:Optional[Union[DType, tuple[DType, ...]]]=None,
+  def __init__(self, op:Optional[Union[Ops, tuple[Ops, ...], set[Ops], frozenset[Ops]]]=None, dtype:Optional[Union[DType, tuple[DType, ...]]]=None,
                src:Optional[Union[tuple[UPat, ...], list[UPat], UPat]]=None, arg:Any=None,
                name:Optional[str]=None, allow_any_len:bool=False, custom_early_reject:Optional[set[Ops]]=None, location=None):
-    assert op is None or isinstance(op, (Ops, tuple, set)), "op must be Ops or tuple of Ops"
-    self.op: Optional[tuple[Ops, ...]] = (op,) if isinstance(op, Ops) else (tuple(op) if isinstance(op, set) else op)
+    assert op is None or isinstance(op, (Ops, tuple, set, frozenset)), "op must be Ops or tuple of Ops"
+    self.op: Optional[tuple[Ops, ...]] = (op,) if isinstance(op, Ops) else (tuple(op) if isinstance(op, (set, frozenset)) else op)
     self.dtype: Optional[tuple[DType, ...]] = (dtype,) if isinstance(dtype, DType) else dtype
     self.arg, self.name, self._in_src, self.custom_early_reject = arg, name, src, custom_early_reject
     self.src: Any = None
@@ -846,9 +846,14 @@ class PatternMatcher:
   def __add__(self, more:PatternMatcher): return PatternMatcher(self.patterns+more.patterns)
 
   def rewrite(self, uop:UOp, ctx=None) -> UOp|None:
-    ler = {u.op for u in uop.src}
-    for _,match,early_reject in self.pdict.get(uop.op, []):
-      if not early_reject.issubset(ler): continue
+    # no patterns for this op, don't build the early reject set
+    if (pats:=self.pdict.get(uop.op)) is None: return None
+    ler: set[Ops]|None = None
+    for _,match,early_reject in pats:
+      if early_reject:
+        # only build the set of src ops once a pattern needs it
+        if ler is None: ler = {u.op for u in uop.src}
+        if not early_reject.issubset(ler): continue
       if (ret:=match(uop, ctx)) is not None: return ret
     return None
 
@@ -1,48 +1,67 @@
+import weakref
 from typing import cast
-from tinygrad.ops import PatternMatcher, UPat, GroupOp, Ops, UOp, print_uops
+from tinygrad.ops import PatternMatcher, UPat, GroupOp, Ops, UOp, print_uops, sint
 from tinygrad.dtype import DType, ImageDType, dtypes, PtrDType
-from tinygrad.helpers import all_same, dedup, prod, getenv, DEBUG
+from tinygrad.helpers import all_same, prod, getenv, unwrap, DEBUG
+
+# these are expanded once here instead of in every UPat that uses them
+NOT_VIEWABLE = frozenset(GroupOp.All-{Ops.BUFFER, Ops.BUFFER_VIEW, Ops.ASSIGN, Ops.CONST, Ops.DEVICE})
+NOT_SINK = frozenset(GroupOp.All-{Ops.SINK})
+# set literals of Ops are rebuilt on every call, so the sets validators test against live here
+KERNEL_AST_OPS = frozenset({Ops.COPY, Ops.BUFFER_VIEW, Ops.SINK})
+BUFFER_OPS = frozenset({Ops.BUFFER, Ops.BUFFER_VIEW})
+REDUCE_OPS = frozenset({Ops.ADD, Ops.MUL, Ops.MAX})
+# op groups shared by many load/store/index UPats below
+DEFINE_BUFS = (Ops.DEFINE_GLOBAL, Ops.DEFINE_LOCAL)
+BUF_IDX = (Ops.INDEX, Ops.CAST)
 
 buffer_spec = PatternMatcher([
   (UPat(Ops.UNIQUE, dtypes.void, ()), lambda: True),
   (UPat(Ops.DEVICE, dtypes.void, (), name="device"), lambda device: isinstance(device.arg, str)),
   (UPat(Ops.BUFFER, src=(UPat(Ops.DEVICE), UPat(Ops.UNIQUE)), name="buf"),
-   lambda buf: isinstance(buf.arg, int) and isinstance(buf.dtype, (DType, ImageDType))),
+   lambda buf: isinstance(buf.arg, int) and isinstance(buf.dtype, DType)),
   (UPat(Ops.BUFFER_VIEW, src=(UPat(Ops.BUFFER),), name="buf_view"),
    lambda buf_view: isinstance(buf_view.arg, tuple) and len(buf_view.arg) == 2 and all(isinstance(arg, (int, UOp)) for arg in buf_view.arg)),
 ])
 
 def validate_kernel(k:UOp):
-  assert k.arg.ast.op in {Ops.COPY, Ops.BUFFER_VIEW, Ops.SINK}, f"must end with SINK/COPY/BUFFER_VIEW {k.arg}"
+  assert k.arg.ast.op in KERNEL_AST_OPS, f"must end with SINK/COPY/BUFFER_VIEW {k.arg}"
   if k.arg.ast.op is Ops.SINK: assert all(s.op is Ops.STORE for s in k.arg.ast.src), f"SINK must end with STORE {k.arg.ast}"
   return True
 
+def validate_assign(x:UOp):
+  return x.src[0].base.op in BUFFER_OPS and (len(x.src) == 2 or all(s.op is Ops.ASSIGN for s in x.src[2:]))
+
 assign_spec = PatternMatcher([
   # KERNEL can attach to an ASSIGN to describe the compute required to realize a BUFFER
   (UPat(Ops.KERNEL, src=UPat((Ops.BUFFER, Ops.BUFFER_VIEW, Ops.ASSIGN)), name="k"), validate_kernel),
 
   # ASSIGN has a target buffer and a value. It can also optionally depend on other assigns
-  (UPat(Ops.ASSIGN, name="x"),
-   lambda x: x.src[0].base.op in {Ops.BUFFER, Ops.BUFFER_VIEW} and (len(x.src) == 2 or all(s.op is Ops.ASSIGN for s in x.src[2:]))),
+  (UPat(Ops.ASSIGN, name="x"), validate_assign),
 ])
 
 # *** this is the spec of a Tensor in UOp ***
 
+def validate_movement(mv:UOp, x:UOp):
+  # naturally correct
+  if isinstance(mv.arg, tuple) and mv.dtype == x.dtype: return True
+  # "make things that can't be images not images" can change the buffer dtype
+  # this is fine as long as it's a realized buffer and base dtypes match.
+  return (isinstance(mv.dtype, ImageDType) or isinstance(x.dtype, ImageDType)) and x.dtype.base == mv.dtype.base and x.base.op is Ops.BUFFER
+
+def validate_const_st(st:UOp):
+  views = unwrap(st.st).views
+  return views[0].mask is None and len(views) == 1 and all(s == 0 for s in views[0].strides)
+
 tensor_uop_spec = buffer_spec+assign_spec+PatternMatcher([
-  (UPat(GroupOp.Movement, name="mv", src=(UPat.var("x"),)),
-   # naturally correct
-   lambda mv,x: (isinstance(mv.arg, tuple) and mv.dtype == x.dtype) or
-   # "make things that can't be images not images" can change the buffer dtype
-   # this is fine as long as it's a realized buffer and base dtypes match.
-   ((isinstance(mv.dtype, ImageDType) or isinstance(x.dtype, ImageDType)) and x.dtype.base == mv.dtype.base and x.base.op is Ops.BUFFER)),
-  (UPat(Ops.VIEW, src=(UPat(GroupOp.All-{Ops.BUFFER, Ops.BUFFER_VIEW, Ops.ASSIGN, Ops.CONST, Ops.DEVICE}),)), lambda: False),
+  (UPat(GroupOp.Movement, name="mv", src=(UPat.var("x"),)), validate_movement),
+  (UPat(Ops.VIEW, src=(UPat(NOT_VIEWABLE),)), lambda: False),
 
   # Tensor variable bindings
   (UPat(Ops.BIND, dtypes.int, (UPat(Ops.DEFINE_VAR), UPat.cvar(dtype=dtypes.int)), arg=None), lambda: True),
 
   # Tensor const has a device and an unmasked ShapeTracker of stride 0
-  (UPat(Ops.CONST, src=(UPat(Ops.VIEW, name="st", src=(UPat(Ops.DEVICE),)),)),
-   lambda st: st.st.views[0].mask is None and len(st.st.views) == 1 and all(s == 0 for s in st.st.views[0].strides)),
+  (UPat(Ops.CONST, src=(UPat(Ops.VIEW, name="st", src=(UPat(Ops.DEVICE),)),)), validate_const_st),
 
   # DETACH and CONTIGUOUS change how we interpret the source UOp
   # CONTIGUOUS ensures the source UOp realizes
@@ -56,15 +75,24 @@ tensor_uop_spec = buffer_spec+assign_spec+PatternMatcher([
 
 # ***** uop type spec *****
 
+# Ops are small ints, so the DEFINE_VAR/BITCAST check is a bit test
+DYN_INDEX_MASK = (1 << Ops.DEFINE_VAR) | (1 << Ops.BITCAST)
+# memoized per UOp since the same index expressions are validated many times during rewrites
+index_dyn_cache:weakref.WeakKeyDictionary[UOp, bool] = weakref.WeakKeyDictionary()
+def _index_has_dyn(u:UOp) -> bool:
+  if (ret:=index_dyn_cache.get(u)) is None:
+    ret = index_dyn_cache[u] = bool((DYN_INDEX_MASK >> u.op) & 1) or (u.op is Ops.SPECIAL and any(not isinstance(y, int) for y in u.arg[1:])) or \
+      any(_index_has_dyn(s) for s in u.src)
+  return ret
+
 def validate_index(idx:UOp, mask:UOp|None=None):
   if getenv("IGNORE_OOB"): return True
   # this checks for out of bounds access. it is not complete but should catch some issues
   if mask is None and not isinstance(idx.dtype, ImageDType):
     # WEBGPU has a BITCAST in the index. TODO: fix
-    if any(x.op in {Ops.DEFINE_VAR, Ops.BITCAST} or (x.op is Ops.SPECIAL and any(not isinstance(y, int) for y in x.arg[1:])) for x in idx.toposort):
-      return True
-    vmin, vmax, sz = idx.src[1].vmin, idx.src[1].vmax, cast(PtrDType, idx.src[0].dtype).size
-    if sz != -1 and (vmin < 0 or vmax >= sz):
+    if _index_has_dyn(idx.src[1]): return True
+    vmin, vmax, sz = idx.src[1].vmin, idx.src[1].vmax, idx.src[0].dtype.size  # type: ignore[attr-defined]
+    if sz != -1 and ((vmin < 0) | (vmax >= sz)):
       if DEBUG >= 1: print(f"OUT OF BOUNDS ACCESS in INDEX {vmin} - {vmax} not in 0 - {sz}. {idx.src[1].render()=}")
       return False
   return True
@@ -72,7 +100,7 @@ def validate_index(idx:UOp, mask:UOp|None=None):
 # this is the matcher for the final rendered UOps
 # matcher functions returns True or False (or None to not match)
 spec = PatternMatcher([
-  (UPat(Ops.DEFINE_GLOBAL, name="x"), lambda x: isinstance(x.dtype, (PtrDType, ImageDType)) and not x.dtype.local),
+  (UPat(Ops.DEFINE_GLOBAL, name="x"), lambda x: isinstance(x.dtype, PtrDType) and not x.dtype.local),
   (UPat(Ops.DEFINE_LOCAL, name="x"), lambda x: isinstance(x.dtype, PtrDType) and x.dtype.local),
   (UPat(Ops.DEFINE_ACC, src=(UPat.var("c"),), name="x", allow_any_len=True),
    lambda x,c: all(y.op is Ops.RANGE for y in x.src[1:]) and c.dtype == x.dtype),
@@ -89,28 +117,28 @@ spec = PatternMatcher([
   (UPat(Ops.CONST, name="x"), lambda x: type(x.arg) is type(dtypes.as_const(x.arg, x.dtype))),
 
   # early LOAD has a <buf, shapetracker, store?>
-  (UPat(Ops.LOAD, src=(UPat((Ops.DEFINE_GLOBAL, Ops.DEFINE_LOCAL)), UPat(Ops.VIEW))), lambda: True),
-  (UPat(Ops.LOAD, src=(UPat((Ops.DEFINE_GLOBAL, Ops.DEFINE_LOCAL)), UPat(Ops.VIEW), UPat(Ops.STORE))), lambda: True),
+  (UPat(Ops.LOAD, src=(UPat(DEFINE_BUFS), UPat(Ops.VIEW))), lambda: True),
+  (UPat(Ops.LOAD, src=(UPat(DEFINE_BUFS), UPat(Ops.VIEW), UPat(Ops.STORE))), lambda: True),
 
   # early STORE has a <buf, shapetracker, val>
-  (UPat(Ops.STORE, src=(UPat((Ops.DEFINE_GLOBAL, Ops.DEFINE_LOCAL)), UPat(Ops.VIEW), UPat())), lambda: True),
+  (UPat(Ops.STORE, src=(UPat(DEFINE_BUFS), UPat(Ops.VIEW), UPat())), lambda: True),
 
   # **** new style load/store ****
 
   # INDEX is used in new style load/store
   # INDEX takes a <buf, alu, gate?>
-  (UPat(Ops.INDEX, src=(UPat((Ops.DEFINE_GLOBAL, Ops.DEFINE_LOCAL)), UPat()), name="idx"), validate_index),
-  (UPat(Ops.INDEX, src=(UPat((Ops.DEFINE_GLOBAL, Ops.DEFINE_LOCAL)), UPat(), UPat(dtype=dtypes.bool, name="mask")), name="idx"), validate_index),
+  (UPat(Ops.INDEX, src=(UPat(DEFINE_BUFS), UPat()), name="idx"), validate_index),
+  (UPat(Ops.INDEX, src=(UPat(DEFINE_BUFS), UPat(), UPat(dtype=dtypes.bool, name="mask")), name="idx"), validate_index),
 
   # LOAD takes a <bufidx, alt?, barrier?>
-  (UPat(Ops.LOAD, src=(UPat((Ops.INDEX, Ops.CAST)),)), lambda: True),
-  (UPat(Ops.LOAD, src=(UPat((Ops.INDEX, Ops.CAST)), UPat((Ops.IF, Ops.BARRIER)))), lambda: True),
-  (UPat(Ops.LOAD, src=(UPat((Ops.INDEX, Ops.CAST)), UPat.var("alt")), name="ld"), lambda ld,alt: ld.dtype == alt.dtype),
+  (UPat(Ops.LOAD, src=(UPat(BUF_IDX),)), lambda: True),
+  (UPat(Ops.LOAD, src=(UPat(BUF_IDX), UPat((Ops.IF, Ops.BARRIER)))), lambda: True),
+  (UPat(Ops.LOAD, src=(UPat(BUF_IDX), UPat.var("alt")), name="ld"), lambda ld,alt: ld.dtype == alt.dtype),
 
   # STORE takes a <bufidx, val, gate?>
-  (UPat(Ops.STORE, dtype=dtypes.void, src=(UPat((Ops.INDEX, Ops.CAST)), UPat())), lambda: True),
-  (UPat(Ops.STORE, dtype=dtypes.void, src=(UPat((Ops.INDEX, Ops.CAST)), UPat(), UPat(dtype=dtypes.bool))), lambda: True),
-  (UPat(Ops.STORE, dtype=dtypes.void, src=(UPat((Ops.INDEX, Ops.CAST)), UPat(), UPat(Ops.IF))), lambda: True),
+  (UPat(Ops.STORE, dtype=dtypes.void, src=(UPat(BUF_IDX), UPat())), lambda: True),
+  (UPat(Ops.STORE, dtype=dtypes.void, src=(UPat(BUF_IDX), UPat(), UPat(dtype=dtypes.bool))), lambda: True),
+  (UPat(Ops.STORE, dtype=dtypes.void, src=(UPat(BUF_IDX), UPat(), UPat(Ops.IF))), lambda: True),
 
   # most ALUs have all matching dtypes, except CMPLT, CMPNE, and WHERE
   (UPat(Ops.WHERE, name="w", src=(UPat(dtype=dtypes.bool), UPat.var("x"), UPat.var("y"))), lambda w,x,y: w.dtype == x.dtype == y.dtype),
@@ -133,7 +161,7 @@ spec = PatternMatcher([
   (UPat(Ops.IF, dtype=dtypes.void, src=(UPat(), UPat(Ops.BARRIER))), lambda: True),
   (UPat(Ops.ENDIF, dtype=dtypes.void, src=(UPat(Ops.IF),)), lambda: True),
 
-  (UPat(Ops.REDUCE_AXIS, name="x"), lambda x: isinstance(x.arg, tuple) and len(x.arg) >= 2 and x.arg[0] in {Ops.ADD, Ops.MUL, Ops.MAX}),
+  (UPat(Ops.REDUCE_AXIS, name="x"), lambda x: isinstance(x.arg, tuple) and len(x.arg) >= 2 and x.arg[0] in REDUCE_OPS),
   (UPat(Ops.GEP, src=(UPat.var("src"),), name="gep"), lambda gep,src: gep.dtype == src.dtype.scalar()),
   (UPat(Ops.VECTORIZE, name="x"), lambda x: len(x.src)>1 and len(x.src) == x.dtype.count and all(x.dtype == y.dtype.vec(len(x.src)) for y in x.src)),
   (UPat((Ops.BITCAST, Ops.CAST), src=(UPat(),), name="x"), lambda x: x.arg is None),
@@ -152,28 +180,51 @@ spec = PatternMatcher([
 # *** schedule spec only allows buffers, assigns and kernels in the graph ***
 
 sched_spec = buffer_spec+assign_spec+PatternMatcher([
-  (UPat(GroupOp.All-{Ops.SINK}), lambda: False),
+  (UPat(NOT_SINK), lambda: False),
 ])
 
 # *** this is the UOp shape spec ***
 
 def verify_sink_dims(sink:UOp):
-  shape_dims = [sorted(dedup(dims)) for dims in zip(*[x.shape for x in sink.toposort if x.op is not Ops.SINK and x.st is not None])]
-  return all_same([x.st_arg.size for x in sink.src]) and all(len(x) == 1 or (len(x) == 2 and x[0] == 1) for x in shape_dims)
+  # all stores must be the same size, this is cheaper than the shape walk so check it first
+  sizes = (x.st_arg.size for x in sink.src)
+  if (sz:=next(sizes, None)) is not None and any(s != sz for s in sizes): return False
+  shapes = [x.shape for x in sink.toposort if x.op is not Ops.SINK and x.st is not None]
+  if not shapes: return True
+  # like zip(*shapes), only the dims shared by every shape are checked
+  shape_dims:list[set[sint]] = [set() for _ in range(min(len(s) for s in shapes))]
+  # track the distinct sizes seen in each dim, stopping as soon as one isn't 1 or n
+  for shape in shapes:
+    for dims,d in zip(shape_dims, shape):
+      dims.add(d)
+      # NOTE: membership only hashes, comparing a symbolic dim with < or != would build a UOp
+      if len(dims) > 2 or (len(dims) == 2 and 1 not in dims): return False
+  return True
 
 shape_spec = PatternMatcher([
   # shapes must have either 1 or n in each dimension
   (UPat(Ops.SINK, src=UPat(Ops.STORE), name="sink"), verify_sink_dims),
   # all parent UOps must have the same shape
-  (UPat(GroupOp.All-{Ops.SINK}, name="root"), lambda root: all_same([x.shape for x in root.src if x.st is not None])),
+  (UPat(NOT_SINK, name="root"), lambda root: all_same([x.shape for x in root.src if x.st is not None])),
 ])
 
 # ***** uop helpers *****
 
+# UOps are immutable and shared across many uops lists, so remember which specs each UOp already passed
+verified_specs:weakref.WeakKeyDictionary[UOp, set[tuple[PatternMatcher, ...]]] = weakref.WeakKeyDictionary()
+
 def type_verify(uops:list[UOp], *extra_specs:PatternMatcher):
-  specs = [spec, *extra_specs]
+  specs = (spec, *extra_specs)
   for i,u in enumerate(uops):
-    spec_ret = [cast(bool|None, s.rewrite(u)) for s in specs]
-    if any(ret is False for ret in spec_ret) or all(ret is None for ret in spec_ret):
+    if (passed:=verified_specs.get(u)) is not None and specs in passed: continue
+    # fails if any spec returns False or none of them match, stop at the first False
+    ok: bool|None = None
+    for s in specs:
+      if (ret:=cast(bool|None, s.rewrite(u))) is False:
+        ok = False
+        break
+      if ret is not None: ok = True
+    if not ok:
       if DEBUG >= 3: print_uops(uops)
       raise RuntimeError(f"UOp verification failed at {i} on {u.op} {u.dtype} {len(u.src)} {[x.op for x in u.src]} {u.arg}")
+    verified_specs.setdefault(u, set()).add(specs)